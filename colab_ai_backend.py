@@ -1,27 +1,627 @@
 # Install required packages (run this in a separate cell in Colab)
-# !pip install flask-ngrok google-generativeai --quiet
+# !pip install pyngrok quart uvicorn google-generativeai numpy orjson --quiet
 
+import asyncio
+import collections
+import functools
+import hashlib
+import itertools
 import json
 import threading
+import time
 import os
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
+import re
+import traceback
+import types
+import numpy as np
+import orjson
+import uvicorn
+from flask.json.provider import DefaultJSONProvider
+from quart import Quart, Response, request, jsonify
 import google.generativeai as genai
 
+try:
+    from debug_logger import log_debug
+except ImportError:
+    def log_debug(msg):
+        print(f"🔧 DEBUG: {msg}", flush=True)
+
+# Verbose /generate-fast tracing, off unless DEBUG_FAST=1
+_DEBUG = os.getenv('DEBUG_FAST') == '1'
+
+# Code fence Gemini may wrap JSON in (closing fence on its own line), and
+# the first character of a JSON object or array in a response
+_FENCE_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*^```", re.M)
+_JSON_START_RE = re.compile(r'[{\[]')
+_JSON_DECODER = json.JSONDecoder()
+
+# Counts and difficulty words change what a prompt asks for while barely
+# moving its embedding ("5 easy ..." vs "10 hard ...")
+_FACET_RE = re.compile(
+    r'\d+|\b(?:easy|medium|hard|difficult|simple|beginner|intermediate|advanced)\b',
+    re.I)
+
+# Delete raw control characters, turning tabs and newlines into spaces
+_CTRL_CHARS = {c: ' ' if c in (9, 10, 13) else None for c in range(32)}
+
+# Gemini generation settings, shared read-only by every request
+_GEN_CFG_FULL = types.MappingProxyType({
+    'temperature': 0.7,  # Lower temperature for more focused responses
+    'max_output_tokens': 2048,  # Limit output length
+    'top_p': 0.8,
+    'top_k': 40,
+    'response_mime_type': 'application/json'  # Gemini JSON mode
+})
+_GEN_CFG_FAST = types.MappingProxyType({
+    'temperature': 0.5,
+    'max_output_tokens': 1024,  # Smaller limit for speed
+    'top_p': 0.9,
+    'top_k': 20,
+    'response_mime_type': 'application/json'  # Gemini JSON mode
+})
+
+# Frontend served at the root URL
+HTML_PATH = 'ai_question_generator.html'
+
+# Stable instructions for /generate
+GENERATE_SYSTEM_PROMPT = """Generate similar questions following the JSON structure given as INPUT.
 
-def create_app():
-    """Create and configure the Flask application"""
+RULES:
+- Same JSON format
+- Same question type
+- Similar difficulty
+- Valid JSON only
+- No explanations"""
+
+# Prompt templates, built once and filled per request with str.format
+GENERATE_PROMPT_TMPL = "INPUT: {sample}\n\nTASK: {prompt}\n\nOUTPUT:"
+GENERATE_FULL_PROMPT_TMPL = GENERATE_SYSTEM_PROMPT + "\n\n" + GENERATE_PROMPT_TMPL
+FAST_PROMPT_TMPL = "Generate {prompt}. Use this format: {sample}... JSON only:"
+FAST_BATCH_ITEM_TMPL = "{index}. Generate {prompt}. Use this format: {sample}..."
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that parses requests and builds responses with orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
 
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+
+def loads_json(text):
+    """Parse Gemini output with orjson, falling back to json for NaN/Infinity"""
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
+
+
+def json_digest(json_data):
+    """Hash uploaded JSON independent of key order"""
+    canonical = orjson.dumps(json_data, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+
+class ExactCache:
+    """Bounded LRU of Gemini results for repeated identical requests
+
+    Keys are (endpoint, prompt, json_digest). Checked before the semantic
+    cache, so exact repeats skip the embedding call as well.
+    """
+
+    def __init__(self, maxsize=512, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, result):
+        self._entries[key] = (time.time() + self.ttl, result)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class SemanticCache:
+    """Cache Gemini results by prompt meaning instead of exact text.
+
+    Entries are grouped by namespace (endpoint, hash of the uploaded JSON
+    and the prompt's counts and difficulty words), so a cached response is
+    only reused for the same input structure and the same kind of request.
+    Within a namespace, prompts are compared by cosine similarity of their
+    embeddings. The least recently used namespace is dropped once there
+    are more than max_namespaces.
+    """
+
+    def __init__(self, threshold=0.93, ttl=3600, max_entries=256,
+                 max_namespaces=64, embed_model='models/text-embedding-004'):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_namespaces = max_namespaces
+        self.embed_model = embed_model
+        self._lock = threading.Lock()
+        # namespace -> (unit vector matrix, responses, expiry timestamps)
+        self._buckets = collections.OrderedDict()
+
+    @staticmethod
+    def namespace(endpoint, digest, prompt):
+        """Build the namespace key for an endpoint, json_digest() and prompt"""
+        facets = ",".join(m.lower() for m in _FACET_RE.findall(prompt))
+        return f"{endpoint}|{digest}|{facets}"
+
+    async def embed(self, text):
+        """Return the normalized embedding for text, or None on failure"""
+        try:
+            result = await genai.embed_content_async(
+                model=self.embed_model,
+                content=text,
+                task_type='semantic_similarity'
+            )
+        except Exception as e:
+            print(f"⚠️  Embedding failed, skipping cache: {e}")
+            return None
+
+        vector = np.asarray(result['embedding'], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def get(self, namespace, vector):
+        """Return the cached response closest to vector, if similar enough"""
+        with self._lock:
+            bucket = self._buckets.get(namespace)
+            if bucket is None:
+                return None
+
+            matrix, responses, expires = bucket
+            live = expires > time.time()
+            if not live.any():
+                del self._buckets[namespace]
+                return None
+
+            self._buckets.move_to_end(namespace)
+            # Rows are stored normalized, so the dot product is the cosine
+            sims = np.where(live, matrix @ vector, -1.0)
+            best = int(np.argmax(sims))
+            if sims[best] > self.threshold:
+                return responses[best]
+            return None
+
+    def set(self, namespace, vector, response):
+        """Store a response under its prompt embedding"""
+        with self._lock:
+            now = time.time()
+            matrix, responses, expires = self._buckets.get(
+                namespace, (np.empty((0, vector.shape[0]), dtype=np.float32), [], np.empty(0)))
+
+            # Drop expired entries, then the oldest ones if still full
+            keep = np.flatnonzero(expires > now)
+            keep = keep[max(len(keep) - self.max_entries + 1, 0):]
+            matrix = np.vstack([matrix[keep], vector[np.newaxis, :]])
+            responses = [responses[i] for i in keep] + [response]
+            expires = np.append(expires[keep], now + self.ttl)
+
+            self._buckets[namespace] = (matrix, responses, expires)
+            self._buckets.move_to_end(namespace)
+            if len(self._buckets) > self.max_namespaces:
+                self._buckets.popitem(last=False)
+
+
+def _extract_first_json(s):
+    """Return the first complete JSON object or array in s
+
+    The C scanner behind json.JSONDecoder.raw_decode tracks string, escape
+    and nesting state in a single pass, so brackets inside string literals
+    don't end the value early. Returns the text from the first bracket on
+    if the value is incomplete, or s unchanged if there is none.
+    """
+    m = _JSON_START_RE.search(s)
+    if not m:
+        return s
+
+    try:
+        _, end = _JSON_DECODER.raw_decode(s, m.start())
+    except json.JSONDecodeError:
+        return s[m.start():]
+    return s[m.start():end]
+
+
+def _sample_from_dict(json_data):
+    """Use the first question of a {"questions": [...]} upload"""
+    questions = json_data.get('questions')
+    if questions is not None:
+        return questions[0] if questions else json_data
+    return json_data
+
+
+def _sample_from_list(json_data):
+    """Use the first item of a list upload"""
+    return json_data[0] if json_data else json_data
+
+
+# Pick the sample question by the input's top-level type with one lookup
+SAMPLE_EXTRACTORS = {
+    dict: _sample_from_dict,
+    list: _sample_from_list,
+}
+
+
+def extract_sample(json_data):
+    """Return the sample question used to show Gemini the expected format"""
+    extractor = SAMPLE_EXTRACTORS.get(type(json_data))
+    return extractor(json_data) if extractor else json_data
+
+
+# isinstance targets for each JSON type in a shape
+_SHAPE_TYPES = {
+    'object': 'dict',
+    'array': 'list',
+    'string': 'str',
+    'number': '(int, float)',
+    'boolean': 'bool',
+}
+_MISSING = object()
+
+
+def shape_of(sample, depth=0):
+    """Describe a JSON sample as a hashable shape for compile_validator
+
+    Nulls, and anything nested deeper than 8 levels, are left unchecked.
+    """
+    if depth > 8 or sample is None:
+        return None
+    if isinstance(sample, dict):
+        return ('object', tuple((key, shape_of(value, depth + 1))
+                                for key, value in sample.items()))
+    if isinstance(sample, list):
+        return ('array', shape_of(sample[0], depth + 1) if sample else None)
+    if isinstance(sample, bool):
+        return ('boolean',)
+    if isinstance(sample, (int, float)):
+        return ('number',)
+    if isinstance(sample, str):
+        return ('string',)
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def compile_validator(shape):
+    """Generate a validator function specialised for one JSON shape
+
+    The emitted code unrolls every key lookup and type check of the shape,
+    so validating a generated question is straight-line code instead of a
+    generic recursive walk. Values must have the sample's keys and JSON
+    types; null values and extra keys are accepted.
+    """
+    lines = ['def validate(x0):']
+    names = itertools.count(1)
+
+    def emit(shape, var, indent):
+        if shape is None:
+            return
+        pad = '    ' * indent
+        kind = shape[0]
+        lines.append(f"{pad}if {var} is not None:")
+        pad += '    '
+        if kind == 'number':
+            lines.append(
+                f"{pad}if not isinstance({var}, (int, float)) or isinstance({var}, bool): return False")
+        else:
+            lines.append(
+                f"{pad}if not isinstance({var}, {_SHAPE_TYPES[kind]}): return False")
+
+        if kind == 'object':
+            for key, sub in shape[1]:
+                name = f"x{next(names)}"
+                lines.append(f"{pad}{name} = {var}.get({key!r}, _MISSING)")
+                lines.append(f"{pad}if {name} is _MISSING: return False")
+                emit(sub, name, indent + 1)
+        elif kind == 'array' and shape[1] is not None:
+            name = f"x{next(names)}"
+            lines.append(f"{pad}for {name} in {var}:")
+            emit(shape[1], name, indent + 2)
+
+    emit(shape, 'x0', 1)
+    lines.append('    return True')
+
+    namespace = {'_MISSING': _MISSING}
+    exec('\n'.join(lines), namespace)
+    return namespace['validate']
+
+
+def matches_structure(generated, sample):
+    """Check that every generated question has the sample's structure"""
+    validate = compile_validator(shape_of(sample))
+    if isinstance(generated, dict) and isinstance(generated.get('questions'), list):
+        items = generated['questions']
+    elif isinstance(generated, list):
+        items = generated
+    else:
+        items = [generated]
+    return bool(items) and all(validate(item) for item in items)
 
-app = Flask(__name__)
-    CORS(app)  # Enable CORS for all routes
+
+def _unwrap_json(text):
+    """Strip a code fence if present and return the first JSON value"""
+    m = _FENCE_RE.search(text)
+    if m:
+        text = m.group(1).strip()
+    return _extract_first_json(text)
+
+
+def parse_json_response(generated_text):
+    """Parse the JSON object or array from a Gemini response
+
+    Requests run in JSON mode, so bare JSON is parsed directly. Fences and
+    surrounding prose are only searched for when that fails, as a guard
+    against models or prompts that ignore the mime type.
+    """
+    try:
+        return orjson.loads(generated_text)
+    except orjson.JSONDecodeError:
+        return loads_json(_unwrap_json(generated_text))
+
+
+class JsonStreamSplitter:
+    """Split streamed Gemini text into complete JSON values as they close.
+
+    String/escape/depth state is kept between chunks, so each character is
+    scanned once. Emits each object or array element of a top-level array,
+    and of the "questions" array of a top-level object, as soon as that
+    element is complete; other top-level objects are emitted whole. Quoted
+    prose before the JSON (up to the closing quote or end of line) is
+    skipped, so brackets inside it don't open a value.
+    """
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._top = None
+        self._in_str = False
+        self._escaped = False
+        # Depth whose elements are emitted (0: none), and whether any were
+        self._list_depth = 0
+        self._emitted = False
+        # Start of the string being read at depth 1, and the last one read
+        self._key_start = -1
+        self._key = None
+
+    def feed(self, chunk):
+        """Add a chunk and return the JSON texts it completed"""
+        text = self._text + chunk
+        values = []
+        start, depth, top = self._start, self._depth, self._top
+        in_str, escaped = self._in_str, self._escaped
+        list_depth, emitted = self._list_depth, self._emitted
+        key_start, key = self._key_start, self._key
+
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if in_str:
+                if depth == 0:
+                    if c == '"' or c == '\n':
+                        in_str = False
+                elif escaped:
+                    escaped = False
+                elif c == '\\':
+                    escaped = True
+                elif c == '"':
+                    in_str = False
+                    if depth == 1:
+                        # The last string before a '[' at depth 1 is its key
+                        key = text[key_start + 1:i]
+                        key_start = -1
+            elif c == '"':
+                in_str = True
+                if depth == 1:
+                    key_start = i
+            elif c == '{' or c == '[':
+                if depth == 0:
+                    top, start, emitted = c, i, False
+                    list_depth = 1 if c == '[' else 0
+                elif depth == list_depth:
+                    start = i
+                elif c == '[' and depth == 1 and key == 'questions':
+                    list_depth = 2
+                depth += 1
+            elif (c == '}' or c == ']') and depth:
+                depth -= 1
+                if depth and depth == list_depth:
+                    values.append(text[start:i + 1])
+                    start = -1
+                    emitted = True
+                elif depth == 1 and list_depth == 2:
+                    # The questions array closed, the rest of the object
+                    # is not streamed
+                    list_depth = 0
+                elif depth == 0:
+                    if top == '{' and not emitted:
+                        values.append(text[start:i + 1])
+                    start = -1
+                    list_depth = 0
+
+        # Keep only the unfinished value (and key) for the next chunk
+        keep = min((p for p in (start, key_start) if p >= 0), default=-1)
+        if keep >= 0:
+            self._text = text[keep:]
+            self._pos = len(text) - keep
+            if start >= 0:
+                start -= keep
+            if key_start >= 0:
+                key_start -= keep
+        else:
+            self._text = ''
+            self._pos = 0
+
+        self._start, self._depth, self._top = start, depth, top
+        self._in_str, self._escaped = in_str, escaped
+        self._list_depth, self._emitted = list_depth, emitted
+        self._key_start, self._key = key_start, key
+        return values
+
+
+class MicroBatcher:
+    """Coalesce concurrent /generate-fast requests into one Gemini call.
+
+    Requests arriving within max_wait_ms of each other are sent as a
+    single prompt asking for a JSON array with one value per request,
+    and the array is split back by index. Each value must match its own
+    request's sample; single requests, values that don't, and batches
+    whose reply cannot be demultiplexed use one call per request.
+    """
+
+    def __init__(self, model, generation_config, max_batch=8, max_wait_ms=20,
+                 max_batch_output_tokens=8192):
+        self.model = model
+        self.generation_config = generation_config
+        self.max_wait = max_wait_ms / 1000
+        # Keep the combined output within the output token budget
+        item_tokens = generation_config['max_output_tokens']
+        self.max_batch = max(1, min(max_batch,
+                                    max_batch_output_tokens // item_tokens))
+        self._queue = None
+        self._worker = None
+        self._tasks = set()
+
+    def start(self):
+        """Start the consumer task on the running event loop"""
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        """Cancel the consumer task"""
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    async def submit(self, prompt, sample_json, sample):
+        """Queue a request and wait for its parsed JSON result
+
+        sample_json is the (possibly trimmed) format shown to Gemini and
+        sample the parsed question a batched reply is checked against.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompt, sample_json, sample, future))
+        return await future
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Dispatch in the background so the next batch can collect
+            task = asyncio.create_task(self._dispatch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch):
+        if len(batch) == 1:
+            await self._run_single(batch[0])
+            return
+
+        tasks = "\n".join(
+            FAST_BATCH_ITEM_TMPL.format(index=i, prompt=prompt, sample=sample_json)
+            for i, (prompt, sample_json, _, _) in enumerate(batch, 1))
+        batch_prompt = (f"Return a JSON array with one JSON value per task "
+                        f"({len(batch)} values). Value i must satisfy task i "
+                        f"using format i.\n\n{tasks}\n\nJSON array only:")
+        config = dict(self.generation_config,
+                      max_output_tokens=self.generation_config['max_output_tokens'] * len(batch))
+
+        try:
+            response = await self.model.generate_content_async(
+                batch_prompt, generation_config=config)
+            results = parse_json_response(response.text.strip())
+        except Exception as e:
+            print(f"⚠️  Batched generation failed, retrying individually: {e}")
+            results = None
+
+        if not isinstance(results, list) or len(results) != len(batch):
+            await asyncio.gather(*(self._run_single(item) for item in batch))
+            return
+
+        # A value that doesn't follow its own format was likely shifted or
+        # merged with a neighbour, so that request is asked again alone
+        retry = []
+        for item, result in zip(batch, results):
+            future = item[3]
+            if not matches_structure(result, item[2]):
+                retry.append(item)
+            elif not future.done():
+                future.set_result(result)
+        if retry:
+            await asyncio.gather(*(self._run_single(item) for item in retry))
+
+    async def _run_single(self, item):
+        prompt, sample_json, _, future = item
+        try:
+            response = await self.model.generate_content_async(
+                FAST_PROMPT_TMPL.format(prompt=prompt, sample=sample_json),
+                generation_config=self.generation_config
+            )
+            result = parse_json_response(response.text.strip())
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        if not future.done():
+            future.set_result(result)
+
+
+def create_app():
+    """Create and configure the Quart (async Flask) application"""
+    app = Quart(__name__)
+    app.json = OrjsonProvider(app)  # orjson for request bodies and jsonify
+
+    # Fixed allow-all CORS headers for every route
+    @app.before_request
+    async def cors_preflight():
+        if request.method == 'OPTIONS':
+            return Response(status=204)
+
+    @app.after_request
+    async def cors_headers(response):
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Allow-Methods'] = 'POST,GET,OPTIONS'
+        return response
 
     # Configure Gemini API
     # You need to set your API key - get it from https://makersuite.google.com/app/apikey
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', 'YOUR_API_KEY_HERE')
 
     if GEMINI_API_KEY and GEMINI_API_KEY != 'YOUR_API_KEY_HERE':
-        genai.configure(api_key=GEMINI_API_KEY)
+        # gRPC keeps one HTTP/2 channel per client, and the SDK keeps one
+        # client per process, so every request reuses the same connection
+        genai.configure(api_key=GEMINI_API_KEY, transport='grpc')
         model = genai.GenerativeModel('gemini-2.5-pro')
     else:
         model = None
@@ -29,23 +629,82 @@ app = Flask(__name__)
         print("   Get your API key from: https://makersuite.google.com/app/apikey")
         print("   Set it as: os.environ['GEMINI_API_KEY'] = 'your-key-here'")
 
+    # Reuse responses for identical, then near-duplicate, prompts on the
+    # same JSON input
+    exact_cache = ExactCache()
+    semantic_cache = SemanticCache()
+
+    async def lookup_caches(endpoint, prompt, json_data):
+        """Return (cached result or None, key to pass to store_caches)"""
+        digest = json_digest(json_data)
+        exact_key = (endpoint, prompt, digest)
+        cached = exact_cache.get(exact_key)
+        if cached is not None:
+            return cached, (exact_key, None, None)
+
+        namespace = SemanticCache.namespace(endpoint, digest, prompt)
+        vector = await semantic_cache.embed(prompt)
+        if vector is not None:
+            cached = semantic_cache.get(namespace, vector)
+        return cached, (exact_key, namespace, vector)
+
+    def store_caches(cache_key, result):
+        """Store a fresh result in the exact and semantic caches"""
+        exact_key, namespace, vector = cache_key
+        exact_cache.set(exact_key, result)
+        if vector is not None:
+            semantic_cache.set(namespace, vector, result)
+
+    # Group concurrent /generate-fast requests into shared Gemini calls
+    fast_batcher = MicroBatcher(model, _GEN_CFG_FAST) if model else None
+
+    @app.before_serving
+    async def start_batcher():
+        if fast_batcher:
+            fast_batcher.start()
+
+    @app.before_serving
+    async def warm_gemini_channel():
+        """Open the async Gemini channel before the first request needs it"""
+        async def warm():
+            try:
+                await model.count_tokens_async("ping")
+            except Exception as e:
+                print(f"⚠️  Gemini warmup failed: {e}")
+
+        if model:
+            app.add_background_task(warm)
+
+    @app.after_serving
+    async def stop_batcher():
+        if fast_batcher:
+            await fast_batcher.stop()
+
+    # Frontend bytes, re-read only when the file's mtime changes
+    html_cache = {"mtime": None, "body": None}
+
     @app.route('/')
-    def index():
+    async def index():
         """Serve the main HTML page"""
         try:
-            with open('ai_question_generator.html', 'r', encoding='utf-8') as f:
-                return f.read()
+            mtime = os.stat(HTML_PATH).st_mtime_ns
+            if mtime != html_cache["mtime"]:
+                with open(HTML_PATH, 'rb') as f:
+                    html_cache["body"] = f.read()
+                html_cache["mtime"] = mtime
         except FileNotFoundError:
             return jsonify({"error": "Frontend HTML file not found"}), 404
 
+        return Response(html_cache["body"], mimetype='text/html')
 
-@app.route('/generate', methods=['POST'])
-def generate():
+    @app.route('/generate', methods=['POST'])
+    async def generate():
         """Generate similar questions using Gemini AI"""
         try:
-            data = request.get_json()
-            prompt = data.get("prompt", "").strip()
-            json_data = data.get("data", {})
+            data = await request.get_json()
+            data_get = data.get
+            prompt = (data_get("prompt") or "").strip()
+            json_data = data_get("data") or {}
 
             if not prompt:
                 return jsonify({"error": "Prompt is required"}), 400
@@ -60,61 +719,53 @@ def generate():
                     "setup_instructions": {
                         "step1": "Get API key from https://makersuite.google.com/app/apikey",
                         "step2": "Set environment variable: os.environ['GEMINI_API_KEY'] = 'your-key-here'",
-                        "step3": "Restart the Flask server"
+                        "step3": "Restart the server"
                     }
                 }), 500
 
-            # Optimize prompt for faster generation - shorter and more direct
-            sample_structure = str(json_data)[
-                :500] + "..." if len(str(json_data)) > 500 else str(json_data)
-
-            gemini_prompt = f"""Generate similar questions following this JSON structure:
+            # Serve repeated and near-duplicate requests from the caches
+            use_cache = not data_get("no_cache")
+            if use_cache:
+                cached, cache_key = await lookup_caches(
+                    'generate', prompt, json_data)
+                if cached is not None:
+                    return jsonify({
+                        "success": True,
+                        "generated_questions": cached,
+                        "prompt_used": prompt,
+                        "input_structure": "analyzed",
+                        "cached": True
+                    })
 
-INPUT: {sample_structure}
-
-TASK: {prompt}
-
-RULES:
-- Same JSON format
-- Same question type
-- Similar difficulty
-- Valid JSON only
-- No explanations
+            # Optimize prompt for faster generation - shorter and more direct
+            # orjson serializes in C; only the first 500 bytes are decoded
+            raw_structure = orjson.dumps(json_data)
+            sample_structure = raw_structure[:500].decode('utf-8', errors='ignore') + (
+                "..." if len(raw_structure) > 500 else "")
 
-OUTPUT:"""
+            gemini_prompt = GENERATE_FULL_PROMPT_TMPL.format(
+                sample=sample_structure, prompt=prompt)
 
             try:
                 # Generate content using Gemini with optimized settings
-                response = model.generate_content(
+                response = await model.generate_content_async(
                     gemini_prompt,
-                    generation_config={
-                        'temperature': 0.7,  # Lower temperature for more focused responses
-                        'max_output_tokens': 2048,  # Limit output length
-                        'top_p': 0.8,
-                        'top_k': 40
-                    }
+                    generation_config=_GEN_CFG_FULL
                 )
                 generated_text = response.text.strip()
 
-                # Try to extract JSON from the response
-                # Sometimes Gemini wraps JSON in code blocks
-                if '```json' in generated_text:
-                    start = generated_text.find('```json') + 7
-                    end = generated_text.find('```', start)
-                    generated_text = generated_text[start:end].strip()
-                elif '```' in generated_text:
-                    start = generated_text.find('```') + 3
-                    end = generated_text.find('```', start)
-                    generated_text = generated_text[start:end].strip()
-
-                # Parse the generated JSON
+                # Parse the generated JSON (JSON mode, fences as a fallback)
                 try:
-                    generated_questions = json.loads(generated_text)
+                    generated_questions = parse_json_response(generated_text)
                 except json.JSONDecodeError:
-                    # If JSON parsing fails, try to clean the text
-                    generated_text = generated_text.replace(
-                        '\n', '').replace('\\', '')
-                    generated_questions = json.loads(generated_text)
+                    # Raw control characters inside strings are invalid JSON;
+                    # clean them in one translate pass, keeping escapes intact
+                    generated_text = _unwrap_json(
+                        generated_text).translate(_CTRL_CHARS)
+                    generated_questions = loads_json(generated_text)
+
+                if use_cache:
+                    store_caches(cache_key, generated_questions)
 
                 return jsonify({
                     "success": True,
@@ -146,136 +797,129 @@ OUTPUT:"""
                 "type": "server_error"
             }), 500
 
-    @app.route('/generate-fast', methods=['POST'])
-    def generate_fast():
-        """Fast generation with smaller prompts and optimizations"""
-        # Import debug logger
+    async def stream_fast(fast_prompt):
+        """Yield an NDJSON line for each JSON value as Gemini streams it"""
+        splitter = JsonStreamSplitter()
+        sent = 0
         try:
-            from debug_logger import log_debug
-        except ImportError:
-            def log_debug(msg):
-                print(f"🔧 DEBUG: {msg}", flush=True)
+            response = await model.generate_content_async(
+                fast_prompt, stream=True, generation_config=_GEN_CFG_FAST)
+            async for chunk in response:
+                # Chunks carrying only safety or finish metadata have no
+                # parts, and .text raises on them
+                if not chunk.parts:
+                    continue
+                for value in splitter.feed(chunk.text):
+                    yield orjson.dumps(loads_json(value)) + b'\n'
+                    sent += 1
+        except Exception as e:
+            yield orjson.dumps({"error": f"Fast generation failed: {str(e)}"}) + b'\n'
+            return
+
+        if not sent:
+            yield orjson.dumps({"error": "No JSON found in Gemini response"}) + b'\n'
 
+    @app.route('/generate-fast', methods=['POST'])
+    async def generate_fast():
+        """Fast generation with smaller prompts and optimizations"""
         try:
-            log_debug("Fast generation started")
-            import sys
+            if _DEBUG:
+                log_debug("Fast generation started")
 
-            data = request.get_json()
-            print(
-                f"🔧 DEBUG: Received data keys: {list(data.keys()) if data else 'None'}", flush=True)
-            sys.stdout.flush()
+            data = await request.get_json()
+            if _DEBUG:
+                log_debug(
+                    f"Received data keys: {list(data.keys()) if data else 'None'}")
 
-            prompt = data.get("prompt", "").strip()
-            json_data = data.get("data", {})
+            data_get = data.get
+            prompt = (data_get("prompt") or "").strip()
+            json_data = data_get("data") or {}
 
-            print(f"🔧 DEBUG: Prompt length: {len(prompt)}", flush=True)
-            print(f"🔧 DEBUG: JSON data type: {type(json_data)}", flush=True)
-            sys.stdout.flush()
+            if _DEBUG:
+                log_debug(f"Prompt length: {len(prompt)}")
+                log_debug(f"JSON data type: {type(json_data)}")
 
             if not prompt or not json_data:
-                print("🔧 DEBUG: Missing prompt or data", flush=True)
-                sys.stdout.flush()
+                if _DEBUG:
+                    log_debug("Missing prompt or data")
                 return jsonify({"error": "Prompt and data required"}), 400
 
             if not model:
-                print("🔧 DEBUG: Gemini model not configured", flush=True)
-                sys.stdout.flush()
+                if _DEBUG:
+                    log_debug("Gemini model not configured")
                 return jsonify({"error": "Gemini API not configured"}), 500
 
+            # Streaming bypasses the batcher and the caches
+            stream = bool(data_get("stream"))
+            use_cache = not stream and not data_get("no_cache")
+            if use_cache:
+                cached, cache_key = await lookup_caches(
+                    'generate-fast', prompt, json_data)
+                if cached is not None:
+                    if _DEBUG:
+                        log_debug("Cache hit")
+                    return jsonify({
+                        "success": True,
+                        "generated_questions": cached,
+                        "mode": "fast",
+                        "cached": True
+                    })
+
             # For faster processing, extract just the structure
             try:
-                print("🔧 DEBUG: Extracting sample structure...", flush=True)
-                sys.stdout.flush()
+                sample_q = extract_sample(json_data)
 
-                if isinstance(json_data, dict) and 'questions' in json_data:
-                    sample_q = json_data['questions'][0] if json_data['questions'] else json_data
-                elif isinstance(json_data, list) and json_data:
-                    sample_q = json_data[0]
-                else:
-                    sample_q = json_data
-
-                print(
-                    f"🔧 DEBUG: Sample structure type: {type(sample_q)}", flush=True)
-                sys.stdout.flush()
+                if _DEBUG:
+                    log_debug(f"Sample structure type: {type(sample_q)}")
 
                 # Ultra-short prompt for speed
-                sample_json = json.dumps(sample_q, indent=0)[:200]
-                fast_prompt = f"Generate {prompt}. Use this format: {sample_json}... JSON only:"
-                print(
-                    f"🔧 DEBUG: Prompt created, length: {len(fast_prompt)}", flush=True)
-                sys.stdout.flush()
+                sample_json = orjson.dumps(sample_q).decode('utf-8')[:200]
 
             except Exception as extract_error:
-                print(
-                    f"🔧 DEBUG: Error extracting structure: {extract_error}", flush=True)
-                sys.stdout.flush()
+                if _DEBUG:
+                    log_debug(f"Error extracting structure: {extract_error}")
                 return jsonify({"error": f"Failed to extract JSON structure: {str(extract_error)}"}), 500
 
-            try:
-                print("🔧 DEBUG: Calling Gemini API...", flush=True)
-                sys.stdout.flush()
-
-                response = model.generate_content(
-                    fast_prompt,
-                    generation_config={
-                        'temperature': 0.5,
-                        'max_output_tokens': 1024,  # Smaller limit for speed
-                        'top_p': 0.9,
-                        'top_k': 20
-                    }
-                )
+            if stream:
+                return Response(
+                    stream_fast(FAST_PROMPT_TMPL.format(
+                        prompt=prompt, sample=sample_json)),
+                    mimetype='application/x-ndjson')
 
-                generated_text = response.text.strip()
-                print(
-                    f"🔧 DEBUG: Generated text length: {len(generated_text)}", flush=True)
-                print(
-                    f"🔧 DEBUG: First 100 chars: {generated_text[:100]}", flush=True)
-                sys.stdout.flush()
-
-                # Quick JSON extraction
-                if '```' in generated_text:
-                    print("🔧 DEBUG: Found code blocks, extracting JSON...", flush=True)
-                    sys.stdout.flush()
-                    start = generated_text.find('{')
-                    end = generated_text.rfind('}') + 1
-                    if start >= 0 and end > start:
-                        generated_text = generated_text[start:end]
-                        print(
-                            f"🔧 DEBUG: Extracted JSON length: {len(generated_text)}", flush=True)
-                        sys.stdout.flush()
-
-                print("🔧 DEBUG: Parsing JSON...", flush=True)
-                sys.stdout.flush()
-                generated_questions = json.loads(generated_text)
-                print("🔧 DEBUG: JSON parsed successfully!", flush=True)
-                sys.stdout.flush()
+            try:
+                # Gemini call and JSON parsing happen in the batcher
+                generated_questions = await fast_batcher.submit(
+                    prompt, sample_json, sample_q)
+                structure_matched = matches_structure(
+                    generated_questions, sample_q)
+                if _DEBUG:
+                    log_debug(
+                        f"JSON parsed successfully! Structure matched: {structure_matched}")
+
+                # Only cache responses that follow the uploaded structure
+                if use_cache and structure_matched:
+                    store_caches(cache_key, generated_questions)
 
                 return jsonify({
                     "success": True,
                     "generated_questions": generated_questions,
+                    "structure_matched": structure_matched,
                     "mode": "fast"
                 })
 
             except Exception as e:
-                print(f"🔧 DEBUG: Fast generation exception: {e}", flush=True)
-                print(f"🔧 DEBUG: Exception type: {type(e)}", flush=True)
-                import traceback
-                print(
-                    f"🔧 DEBUG: Full traceback:\n{traceback.format_exc()}", flush=True)
-                sys.stdout.flush()
+                if _DEBUG:
+                    log_debug(
+                        f"Fast generation exception ({type(e)}):\n{traceback.format_exc()}")
                 return jsonify({"error": f"Fast generation failed: {str(e)}"}), 500
 
         except Exception as e:
-            print(f"🔧 DEBUG: Server error: {e}", flush=True)
-            print(f"🔧 DEBUG: Exception type: {type(e)}", flush=True)
-            import traceback
-            print(
-                f"🔧 DEBUG: Full traceback:\n{traceback.format_exc()}", flush=True)
-            sys.stdout.flush()
+            if _DEBUG:
+                log_debug(f"Server error ({type(e)}):\n{traceback.format_exc()}")
             return jsonify({"error": f"Server error: {str(e)}"}), 500
 
     @app.route('/health', methods=['GET'])
-    def health():
+    async def health():
         """Health check endpoint"""
         return jsonify({
             "status": "running",
@@ -286,10 +930,10 @@ OUTPUT:"""
         })
 
     @app.route('/debug', methods=['POST'])
-    def debug_endpoint():
+    async def debug_endpoint():
         """Debug endpoint to test data processing"""
         try:
-    data = request.get_json()
+            data = await request.get_json()
             return jsonify({
                 "received_data": {
                     "keys": list(data.keys()) if data else None,
@@ -312,33 +956,35 @@ OUTPUT:"""
     return app
 
 
+def serve(app, host='127.0.0.1', port=5000):
+    """Serve the ASGI app with uvicorn on a single event loop
+
+    uvicorn picks uvloop and httptools automatically when they are installed.
+    """
+    config = uvicorn.Config(app, host=host, port=port, workers=1,
+                            loop='auto', http='auto')
+    uvicorn.Server(config).run()
+
+
 def run_flask_app():
-    """Run the Flask app with ngrok in a separate thread"""
+    """Run the app with ngrok in a separate thread"""
     app = create_app()
 
-    # Try different ngrok approaches
-    print("🚀 Starting Flask server...")
+    print("🚀 Starting async server...")
     print("📁 Serving frontend at root URL")
     print("🤖 Gemini AI integration ready")
 
-    # Method 1: Try pyngrok (more reliable)
     try:
         from pyngrok import ngrok
-        import time
 
         print("🔗 Attempting to create ngrok tunnel with pyngrok...")
 
-        # Start Flask in background
-        import threading
-
-        def run_flask():
-            app.run(host='127.0.0.1', port=5000,
-                    debug=False, use_reloader=False)
-
-        flask_thread = threading.Thread(target=run_flask, daemon=True)
-        flask_thread.start()
+        # Start the server in background
+        server_thread = threading.Thread(
+            target=serve, args=(app,), daemon=True)
+        server_thread.start()
 
-        # Wait for Flask to start
+        # Wait for the server to start
         time.sleep(2)
 
         # Create ngrok tunnel
@@ -346,34 +992,20 @@ def run_flask_app():
         print(f"✅ ngrok tunnel created: {public_url}")
         print(f"🌐 Access your web app at: {public_url}")
 
-        # Keep the tunnel alive
+        # Keep the tunnel alive; block until interrupted instead of polling
+        _stop = threading.Event()
         try:
-            ngrok_process = ngrok.get_ngrok_process()
-            while True:
-                time.sleep(1)
+            _stop.wait()
         except KeyboardInterrupt:
             print("🛑 Stopping ngrok tunnel...")
             ngrok.disconnect(public_url)
 
     except ImportError:
-        print("📦 pyngrok not found, trying flask-ngrok...")
-
-        # Method 2: Try flask-ngrok
-        try:
-            from flask_ngrok import run_with_ngrok
-            run_with_ngrok(app)
-            print("🔗 Using flask-ngrok tunnel")
-            app.run()
-
-        except ImportError:
-            print("📦 Installing pyngrok for better ngrok support...")
-            import subprocess
-            subprocess.check_call(['pip', 'install', 'pyngrok', '--quiet'])
-            print("✅ Installation complete. Please restart the server.")
-
-        except Exception as ngrok_error:
-            print(f"⚠️  flask-ngrok failed: {ngrok_error}")
-            run_local_fallback(app)
+        # flask-ngrok only wraps Flask's dev server, so pyngrok is required
+        print("📦 Installing pyngrok for ngrok support...")
+        import subprocess
+        subprocess.check_call(['pip', 'install', 'pyngrok', '--quiet'])
+        print("✅ Installation complete. Please restart the server.")
 
     except Exception as e:
         print(f"⚠️  pyngrok failed: {e}")
@@ -396,7 +1028,7 @@ def run_local_fallback(app):
         except:
             print("🔗 Local access: http://127.0.0.1:5000")
 
-        app.run(host='127.0.0.1', port=5000, debug=False)
+        serve(app)
 
     except Exception as fallback_error:
         print(f"❌ All methods failed: {fallback_error}")
@@ -4,30 +4,529 @@ AI Question Generator - Local Development Backend
 Optimized for running in IDE with proper error handling and debugging
 """
 
+import atexit
+import collections
+import datetime
+import hashlib
 import json
 import os
 import logging
-from flask import Flask, request, jsonify
+import logging.handlers
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import diskcache
+import orjson
+from flask import Flask, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.exceptions import NotFound
 import google.generativeai as genai
+from google.generativeai import caching
+from json_repair import repair_json
 from dotenv import load_dotenv
 load_dotenv()  # Load environment variables from .env file
 
-# Set up logging for local development
+try:
+    # Optional: enables the semantic topic cache
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# Set up logging for local development; LOG_LEVEL=DEBUG for step traces
+# Unknown names fall back to INFO instead of failing basicConfig; only
+# known names map to a number (getLevelNamesMapping needs 3.11)
+_REQUESTED_LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVEL = (_REQUESTED_LOG_LEVEL
+             if isinstance(logging.getLevelName(_REQUESTED_LOG_LEVEL), int)
+             else 'INFO')
+
+# Records are queued and written by a background thread, so file and
+# console I/O stays off the request thread
+_log_queue = queue.SimpleQueue()
+_log_handlers = (logging.FileHandler('app.log'), logging.StreamHandler())
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=LOG_LEVEL,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
 )
 logger = logging.getLogger(__name__)
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+if LOG_LEVEL != _REQUESTED_LOG_LEVEL:
+    logger.warning("⚠️  Unknown LOG_LEVEL %r, using INFO",
+                   _REQUESTED_LOG_LEVEL)
+
+# Persistent cache of generated questions, shared across restarts
+CACHE_DIR = './.gencache'
+CACHE_EXPIRE = 86400  # seconds
+response_cache = diskcache.Cache(CACHE_DIR)
+
+# Opt-in: upload repeated structure blocks to Gemini's context cache
+CONTEXT_CACHE = os.getenv('GEMINI_CONTEXT_CACHE') == '1'
+MODEL_NAME = 'gemini-2.5-pro'
+
+HTML_PATH = 'ai_question_generator.html'
+
+_GEN_CFG = {
+    'temperature': 0.5,        # Lower temperature for more consistent JSON
+    'max_output_tokens': 8192,  # Even larger for complex exercises
+    'top_p': 0.9,             # Higher top_p for more complete responses
+    'top_k': 20               # Lower top_k for more focused output
+}
+
+# Sample used when the upload has no question to copy
+_DEFAULT_SAMPLE = {"text": "Sample question",
+                   "options": ["A", "B", "C", "D"], "correct": 0}
+
+# Prompt pieces, filled per request by build_gemini_prompt
+_PROMPT_TEMPLATE = """Create {n} {lang}-Mongolian translation exercises about "{topic}".
+
+REQUIREMENTS:
+1. Match the JSON structure exactly
+2. {n} questions in the questions array
+3. Mix of {lang}→Mongolian and Mongolian→{lang} translations
+4. Use topic: {topic}
+5. Vary question_mode (TRANSLATE, CHOOSE, TYPE)
+6. Mongolian text uses "TEXT" or "TEXT_AUDIO" type
+7. Valid JSON only, no explanations{part}
+
+{structure}"""
+_PART_TEMPLATE = """
+8. This is part {i} of {k} of a larger set, pick a different slice of the topic"""
+_STRUCTURE_TEMPLATE = """STRUCTURE:
+{struct}
+
+OUTPUT: Complete valid JSON object matching this structure."""
+_CACHED_STRUCTURE = """STRUCTURE: the JSON example in the cached context.
+
+OUTPUT: Complete valid JSON object matching that structure."""
+
+# Requests above SPLIT_THRESHOLD questions become parallel calls of at most
+# SPLIT_SIZE questions, SPLIT_CONCURRENCY at a time
+SPLIT_THRESHOLD = 10
+SPLIT_SIZE = 5
+SPLIT_CONCURRENCY = 4
+
+_JSON_DECODER = json.JSONDecoder()
+# Body of the first ``` / ```json fence, up to the end if it was cut off
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)(?:```|$)', re.DOTALL)
+
+
+class MemoryCache:
+    """Bounded in-process LRU kept in front of the disk cache
+
+    Hits skip diskcache's SQLite read and unpickling. Each entry keeps the
+    expiry of its disk copy so both layers go stale together.
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        # key -> (expires_at, generated_questions)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, generated_questions, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, generated_questions)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+memory_cache = MemoryCache()
+
+
+def cached_result(key):
+    """Look up a cached result in memory, then on disk"""
+    hit = memory_cache.get(key)
+    if hit is None:
+        hit, expires_at = response_cache.get(key, expire_time=True)
+        if hit is not None:
+            memory_cache.set(key, hit, expires_at)
+    return hit
+
+
+def store_result(key, generated_questions):
+    """Cache a fresh result in memory and on disk"""
+    memory_cache.set(key, generated_questions, time.time() + CACHE_EXPIRE)
+    response_cache.set(key, generated_questions, expire=CACHE_EXPIRE)
+
+
+def cache_key(language, topic, num_questions, canonical_bytes):
+    """Build the exact-match cache key for a generation request
+
+    canonical_bytes is the upload serialized with sorted keys, so the same
+    data hits regardless of key order.
+    """
+    prefix = f"{language}|{topic}|{num_questions}|".encode('utf-8')
+    return hashlib.blake2b(prefix + canonical_bytes).hexdigest()
+
+
+class ResponseError(ValueError):
+    """Gemini output that could not be turned into questions"""
+
+    def __init__(self, message, raw_response=None):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+
+def split_counts(num_questions):
+    """Split a question count into near-equal parts of at most SPLIT_SIZE"""
+    k = -(-num_questions // SPLIT_SIZE)
+    return [num_questions // k + (i < num_questions % k) for i in range(k)]
+
+
+def build_gemini_prompt(num_questions, language, topic, base_ex_str,
+                        cached, part=None):
+    """Build the generation prompt; cached omits the structure block"""
+    if cached:
+        structure = _CACHED_STRUCTURE
+    else:
+        structure = _STRUCTURE_TEMPLATE.format(struct=base_ex_str)
+
+    return _PROMPT_TEMPLATE.format_map({
+        "n": num_questions,
+        "lang": language,
+        "topic": topic,
+        "part": _PART_TEMPLATE.format(i=part[0], k=part[1]) if part else "",
+        "structure": structure,
+    })
+
+
+def has_requested_questions(generated_questions, num_questions):
+    """Check that a result holds a questions array of the requested size"""
+    return (isinstance(generated_questions, dict)
+            and isinstance(generated_questions.get("questions"), list)
+            and len(generated_questions["questions"]) == num_questions)
+
+
+def parse_generated_text(generated_text, num_questions):
+    """Extract and parse the JSON object in a Gemini response
+
+    Returns (generated_questions, cacheable); only complete, unrepaired
+    results with num_questions questions are cacheable. Raises
+    ResponseError when no JSON can be located and json.JSONDecodeError
+    when it cannot be parsed, or the repaired value fails that check.
+    """
+    # Log the full response for debugging
+    logger.debug("Full response: %s", generated_text)
+
+    # Check if response is truncated or incomplete
+    if len(generated_text) < 20:
+        logger.error("Response too short, likely incomplete")
+        raise ResponseError("Gemini response was too short/incomplete")
+
+    # Find JSON content, inside code block markers if present, else from
+    # the first brace; the parsers below decide where the object ends
+    match = _JSON_FENCE_RE.search(generated_text)
+    if match and match.group(1).lstrip().startswith('{'):
+        clean_text = match.group(1).strip()
+    elif '{' in generated_text:
+        clean_text = generated_text[generated_text.find('{'):].strip()
+    else:
+        logger.error("Could not find valid JSON boundaries")
+        raise ResponseError("Could not extract JSON from response",
+                            raw_response=generated_text[:300])
+    logger.debug("Extracted JSON length: %d", len(clean_text))
+
+    # Try parsing original first, then the first complete object (Gemini
+    # sometimes appends text), then a single json-repair pass
+    try:
+        generated_questions = orjson.loads(clean_text)
+        logger.debug("JSON parsed successfully on first attempt")
+    except json.JSONDecodeError as first_error:
+        logger.warning("First JSON parse failed: %s", first_error)
+        try:
+            generated_questions, _ = _JSON_DECODER.raw_decode(clean_text)
+            logger.info("Successfully extracted partial JSON")
+        except json.JSONDecodeError:
+            logger.debug("Attempting to repair JSON...")
+            # Fixes trailing commas, unclosed brackets and cut-off strings,
+            # but may invent keys or drop questions, so the result is
+            # only used when complete and is never cached
+            generated_questions = orjson.loads(repair_json(clean_text))
+            if not has_requested_questions(generated_questions, num_questions):
+                raise first_error
+            logger.info("JSON parsed successfully after repair")
+            return generated_questions, False
+
+    return generated_questions, has_requested_questions(
+        generated_questions, num_questions)
+
+
+def merge_split_results(parts):
+    """Combine split generations into the first part's structure"""
+    if len(parts) == 1:
+        return parts[0]
+
+    if not all(isinstance(p, dict) and isinstance(p.get("questions"), list)
+               for p in parts):
+        raise ResponseError("Split responses did not all contain a questions array")
+
+    merged = dict(parts[0])
+    merged["questions"] = [q for p in parts for q in p["questions"]]
+    return merged
+
+
+def dump_example(obj):
+    """Serialize a JSON example for embedding in the prompt"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that parses requests and builds responses with orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+
+# Structure blocks by upload digest; only the strings are kept, not uploads
+_structure_blocks = MemoryCache(maxsize=128)
+
+
+def _build_prompt_context(json_data, json_bytes, upload_digest):
+    """Pick the sample question and prompt structure block for an upload
+
+    json_bytes is json_data serialized in upload order, so the block shows
+    keys as the user wrote them. The block is memoized per upload_digest,
+    so repeated uploads skip re-serialization.
+    """
+    match json_data:
+        case {"questions": [first, *_]}:
+            sample_q = first
+            logger.debug("Using first question from questions array")
+        case {"questions": _}:
+            sample_q = _DEFAULT_SAMPLE
+            logger.debug("Empty questions array, using default structure")
+        case [{"questions": [first, *_]}, *_]:
+            # A list whose first item has a questions array
+            sample_q = first
+            logger.debug(
+                "Using first question from first item's questions array")
+        case [first, *_]:
+            sample_q = first
+            logger.debug("Using first item from list as sample")
+        case dict():
+            sample_q = json_data
+            logger.debug("Using entire dict as sample structure")
+        case _:
+            # Fallback for other types
+            sample_q = _DEFAULT_SAMPLE
+            logger.debug("Using default sample structure")
+
+    base_ex_str = _structure_blocks.get(upload_digest)
+    if base_ex_str is not None:
+        return sample_q, base_ex_str
+
+    base_ex = json_data  # Use the uploaded JSON as the base example
+
+    # Handle different JSON structures (list vs dict)
+    if isinstance(base_ex, list):
+        # If it's a list, use the first item or create a simple structure
+        if base_ex:
+            base_ex_str = dump_example(base_ex[0])
+        else:
+            base_ex_str = dump_example({"example": "structure"})
+    elif isinstance(base_ex, dict):
+        # Create a more concise prompt to avoid truncation; json_bytes
+        # already is the serialized dict, so only a trimmed copy is dumped
+        base_ex_str = json_bytes.decode('utf-8')
+        if len(base_ex_str) > 2000:  # Limit example size
+            # Extract just the structure with first question as example
+            structure_example = {
+                "data": base_ex.get("data", {}),
+                "questions": base_ex.get("questions", [{}])[:1] if base_ex.get("questions") else [{}]
+            }
+            base_ex_str = dump_example(structure_example)
+    else:
+        # Fallback for other types
+        base_ex_str = json_bytes.decode('utf-8')
+
+    _structure_blocks.set(upload_digest, base_ex_str, float('inf'))
+    return sample_q, base_ex_str
+
+
+def structure_fingerprint(obj):
+    """Describe the key layout of uploaded JSON, ignoring its values"""
+    if isinstance(obj, dict):
+        inner = ",".join(f"{k}:{structure_fingerprint(v)}"
+                         for k, v in sorted(obj.items()))
+        return "{" + inner + "}"
+    if isinstance(obj, list):
+        return "[" + (structure_fingerprint(obj[0]) if obj else "") + "]"
+    return type(obj).__name__
+
+
+class SemanticCache:
+    """Reuse results for re-phrased topics ("colors" vs "basic colors")
+
+    Entries are grouped by namespace (language, question count and JSON
+    structure), so only results with the same shape are ever reused.
+    Within a namespace the closest topic embedding wins if its cosine
+    similarity reaches the threshold. Empty namespaces are dropped, and
+    the least recently used one goes once there are more than
+    max_namespaces.
+    """
+
+    def __init__(self, encoder, threshold=0.92, ttl=CACHE_EXPIRE,
+                 max_entries=256, max_namespaces=64):
+        self.encoder = encoder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_namespaces = max_namespaces
+        # namespace -> list of [expires, vector, generated_questions]
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed(self, text):
+        """Return a unit-length embedding for text"""
+        return self.encoder.encode(text, normalize_embeddings=True)
+
+    def get(self, namespace, vector):
+        now = time.time()
+        with self._lock:
+            entries = self._entries.get(namespace)
+            if entries is None:
+                return None
+            entries = [e for e in entries if e[0] > now]
+            if not entries:
+                del self._entries[namespace]
+                return None
+            self._entries[namespace] = entries
+            self._entries.move_to_end(namespace)
+            scores = np.stack([e[1] for e in entries]) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            return entries[best][2]
+
+    def set(self, namespace, vector, generated_questions):
+        with self._lock:
+            now = time.time()
+            entries = [e for e in self._entries.get(namespace, ())
+                       if e[0] > now]
+            entries.append([now + self.ttl, vector, generated_questions])
+            del entries[:-self.max_entries]
+            self._entries[namespace] = entries
+            self._entries.move_to_end(namespace)
+            if len(self._entries) > self.max_namespaces:
+                self._entries.popitem(last=False)
+
+
+class ContextCache:
+    """Keep each large prompt structure block in Gemini's context cache
+
+    The structure block is the stable prefix of every prompt, so it is
+    uploaded once and later requests only send the short instruction tail.
+    Gemini refuses prefixes below min_tokens, so shorter ones are skipped
+    (by length first, then count_tokens) and callers fall back to the full
+    prompt. Uploads run outside the shared lock, one per key at a time.
+    Handles and refusals are kept for the TTL, at most max_entries of
+    them in LRU order; evicted handles simply expire on the server.
+    """
+
+    def __init__(self, model_name, ttl_seconds=3600, min_tokens=4096,
+                 max_entries=64):
+        self.model_name = model_name
+        self.ttl = datetime.timedelta(seconds=ttl_seconds)
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        # blake2b(structure) -> (expires_at, GenerativeModel or None)
+        self._entries = collections.OrderedDict()
+        # blake2b(structure) -> lock held while that key is being created
+        self._creating = {}
+        self._lock = threading.Lock()
+
+    def model_for(self, base_ex_str):
+        """Return a model bound to the cached structure, or None"""
+        # A token is at least one character, so this can't reach the minimum
+        if len(base_ex_str) < self.min_tokens:
+            return None
+
+        key = hashlib.blake2b(base_ex_str.encode('utf-8')).hexdigest()
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry[1]
+
+        with self._lock:
+            key_lock = self._creating.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another request may have created it while we waited
+            entry = self._lookup(key)
+            if entry is None:
+                entry = self._create(key, base_ex_str)
+                with self._lock:
+                    self._entries[key] = entry
+                    if len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                    self._creating.pop(key, None)
+        return entry[1]
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _create(self, key, base_ex_str):
+        # Leave a margin so requests never race the server-side expiry
+        expires_at = time.time() + self.ttl.total_seconds() - 60
+        try:
+            tokens = genai.GenerativeModel(self.model_name).count_tokens(
+                base_ex_str).total_tokens
+            if tokens < self.min_tokens:
+                logger.debug("Structure has %d tokens, too small to cache",
+                             tokens)
+                return (expires_at, None)
+
+            cached = caching.CachedContent.create(
+                model=self.model_name,
+                display_name=f"structure-{key[:16]}",
+                contents=[base_ex_str],
+                ttl=self.ttl
+            )
+            cached_model = genai.GenerativeModel.from_cached_content(
+                cached_content=cached)
+        except Exception as e:
+            logger.warning(
+                "⚠️  Context caching unavailable, using full prompt: %s", e)
+            return (expires_at, None)
+
+        logger.info("🗄️  Cached JSON structure as %s", cached.name)
+        return (expires_at, cached_model)
 
 
 def create_app():
     """Create and configure the Flask application for local development"""
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
     CORS(app)
 
     logger.info("🚀 Starting AI Question Generator (Local Mode)")
@@ -42,21 +541,69 @@ def create_app():
         model = None
     else:
         try:
-            genai.configure(api_key=GEMINI_API_KEY)
+            # gRPC keeps one multiplexed HTTP/2 channel per process
+            genai.configure(api_key=GEMINI_API_KEY, transport='grpc')
             # Use the standard model that's more reliable
-            model = genai.GenerativeModel('gemini-2.5-pro')
+            model = genai.GenerativeModel(MODEL_NAME)
             logger.info("✅ Gemini model configured successfully")
         except Exception as e:
-            logger.error(f"❌ Error configuring Gemini: {e}")
+            logger.error("❌ Error configuring Gemini: %s", e)
             model = None
 
+    if model:
+        # Open the channel now so the first request skips TCP/TLS setup;
+        # count_tokens is free, unlike a 1-token generation
+        def warm_gemini_channel():
+            try:
+                model.count_tokens("ping")
+            except Exception as e:
+                logger.warning("⚠️  Gemini warmup failed: %s", e)
+
+        threading.Thread(target=warm_gemini_channel, daemon=True).start()
+
+    context_cache = ContextCache(MODEL_NAME) if (
+        model and CONTEXT_CACHE) else None
+
+    # Bounds in-flight split calls per process to respect Gemini QPS
+    split_pool = ThreadPoolExecutor(max_workers=SPLIT_CONCURRENCY)
+
+    def generate_text(generate_model, gemini_prompt):
+        """Run one Gemini generation and return its stripped text"""
+        started = time.perf_counter()
+        response = generate_model.generate_content(
+            gemini_prompt,
+            generation_config=_GEN_CFG
+        )
+        logger.debug("Gemini answered after %.2fs",
+                     time.perf_counter() - started)
+
+        # A blocked prompt returns no candidates, and .parts and .text
+        # raise on it; .text also raises on a candidate without parts
+        if not response.candidates or not response.parts:
+            return ""
+        return response.text.strip()
+
+    # Load the embedding model once for the semantic topic cache
+    semantic_cache = None
+    if SentenceTransformer is None:
+        logger.info(
+            "ℹ️  sentence-transformers not installed, semantic cache disabled")
+    else:
+        try:
+            semantic_cache = SemanticCache(SentenceTransformer(
+                'sentence-transformers/all-MiniLM-L6-v2'))
+            logger.info("✅ Semantic cache enabled")
+        except Exception as e:
+            logger.error("❌ Error loading embedding model: %s", e)
+
     @app.route('/')
     def index():
         """Serve the main HTML page"""
+        # Lets the WSGI server use sendfile, and adds ETag/Last-Modified
+        # so browsers revalidate with a 304
         try:
-            with open('ai_question_generator.html', 'r', encoding='utf-8') as f:
-                return f.read()
-        except FileNotFoundError:
+            return send_from_directory('.', HTML_PATH, max_age=300)
+        except NotFound:
             logger.error("HTML file not found")
             return jsonify({"error": "Frontend HTML file not found"}), 404
 
@@ -85,18 +632,22 @@ def create_app():
                 logger.error("No JSON data received")
                 return jsonify({"error": "No JSON data received"}), 400
 
-            logger.debug(f"Received data keys: {list(data.keys())}")
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                logger.debug("Received data keys: %s", list(data.keys()))
 
             # Step 2: Extract parameters
             language = data.get("language", "English").strip()
             topic = data.get("topic", "").strip()
             num_questions = data.get("num_questions", 10)
             json_data = data.get("data", {})
+            use_cache = not data.get("no_cache")
 
-            logger.debug(f"Language: {language}")
-            logger.debug(f"Topic: {topic}")
-            logger.debug(f"Number of questions: {num_questions}")
-            logger.debug(f"JSON data type: {type(json_data)}")
+            if debug:
+                logger.debug("Language: %s", language)
+                logger.debug("Topic: %s", topic)
+                logger.debug("Number of questions: %s", num_questions)
+                logger.debug("JSON data type: %s", type(json_data))
 
             # Step 3: Validate input
             if not topic:
@@ -104,7 +655,7 @@ def create_app():
                 return jsonify({"error": "Topic is required"}), 400
 
             if not isinstance(num_questions, int) or num_questions < 1 or num_questions > 20:
-                logger.error(f"Invalid number of questions: {num_questions}")
+                logger.error("Invalid number of questions: %s", num_questions)
                 return jsonify({"error": "Number of questions must be between 1 and 20"}), 400
 
             if not json_data:
@@ -120,125 +671,102 @@ def create_app():
 
             logger.info("✅ Input validation passed")
 
-            # Step 4: Extract sample structure
+            # Upload bytes in the user's key order and their digest, for
+            # the prompt's structure block
+            json_bytes = orjson.dumps(json_data)
+            upload_digest = hashlib.blake2b(json_bytes).digest()
+
+            # Serve identical, then re-phrased, requests without Gemini
+            if use_cache:
+                key = cache_key(
+                    language, topic, num_questions,
+                    orjson.dumps(json_data, option=orjson.OPT_SORT_KEYS))
+                hit = cached_result(key)
+                topic_vec = None
+                if hit is None and semantic_cache is not None:
+                    topic_ns = (language, num_questions,
+                                structure_fingerprint(json_data))
+                    topic_vec = semantic_cache.embed(f"{language}:{topic}")
+                    hit = semantic_cache.get(topic_ns, topic_vec)
+                if hit is not None:
+                    logger.info("✅ Cache hit, skipping Gemini call")
+                    return jsonify({
+                        "success": True,
+                        "generated_questions": hit,
+                        "mode": "cache"
+                    })
+
+            # Steps 4-5 depend only on the uploaded JSON, reuse them
             logger.debug("Step 4: Extracting sample structure")
             try:
-                if isinstance(json_data, dict) and 'questions' in json_data:
-                    if json_data['questions'] and len(json_data['questions']) > 0:
-                        sample_q = json_data['questions'][0]
-                        logger.debug(
-                            "Using first question from questions array")
-                    else:
-                        sample_q = {"text": "Sample question", "options": [
-                            "A", "B", "C", "D"], "correct": 0}
-                        logger.debug(
-                            "Empty questions array, using default structure")
-                elif isinstance(json_data, list) and json_data:
-                    # If it's a list, check if the first item has a questions array
-                    first_item = json_data[0]
-                    if isinstance(first_item, dict) and 'questions' in first_item and first_item['questions']:
-                        sample_q = first_item['questions'][0]
-                        logger.debug(
-                            "Using first question from first item's questions array")
-                    else:
-                        sample_q = first_item
-                        logger.debug("Using first item from list as sample")
-                elif isinstance(json_data, dict):
-                    sample_q = json_data
-                    logger.debug("Using entire dict as sample structure")
-                else:
-                    # Fallback for other types
-                    sample_q = {"text": "Sample question",
-                                "options": ["A", "B", "C", "D"], "correct": 0}
-                    logger.debug("Using default sample structure")
-
-                logger.debug(f"Sample structure type: {type(sample_q)}")
-                logger.debug(
-                    f"Sample structure keys: {list(sample_q.keys()) if isinstance(sample_q, dict) else 'Not a dict'}")
+                sample_q, base_ex_str = _build_prompt_context(
+                    json_data, json_bytes, upload_digest)
+                if debug:
+                    logger.debug("Sample structure type: %s", type(sample_q))
+                    logger.debug(
+                        "Sample structure keys: %s",
+                        list(sample_q.keys()) if isinstance(sample_q, dict) else 'Not a dict')
 
             except Exception as e:
-                logger.error(f"Error extracting structure: {e}")
+                logger.error("Error extracting structure: %s", e)
                 return jsonify({"error": f"Failed to extract JSON structure: {str(e)}"}), 500
 
                 # Step 5: Create prompt
             logger.debug("Step 5: Creating Gemini prompt")
             try:
-                # Create the educational prompt for language learning
-                base_ex = json_data  # Use the uploaded JSON as the base example
-
-                # Handle different JSON structures (list vs dict)
-                if isinstance(base_ex, list):
-                    # If it's a list, use the first item or create a simple structure
-                    if base_ex:
-                        base_ex_str = json.dumps(
-                            base_ex[0], indent=0, ensure_ascii=False)
-                    else:
-                        base_ex_str = json.dumps(
-                            {"example": "structure"}, indent=0, ensure_ascii=False)
-                elif isinstance(base_ex, dict):
-                    # Create a more concise prompt to avoid truncation
-                    base_ex_str = json.dumps(
-                        base_ex, indent=0, ensure_ascii=False)
-                    if len(base_ex_str) > 2000:  # Limit example size
-                        # Extract just the structure with first question as example
-                        structure_example = {
-                            "data": base_ex.get("data", {}),
-                            "questions": base_ex.get("questions", [{}])[:1] if base_ex.get("questions") else [{}]
-                        }
-                        base_ex_str = json.dumps(
-                            structure_example, indent=0, ensure_ascii=False)
+                # With a cached structure only the instructions are sent;
+                # only blocks above Gemini's minimum (e.g. a large first
+                # list item) qualify, smaller ones use the full prompt
+                generate_model = model
+                if context_cache:
+                    generate_model = context_cache.model_for(base_ex_str) or model
+                cached = generate_model is not model
+
+                # Large sets are split into parallel smaller generations
+                if (num_questions > SPLIT_THRESHOLD and isinstance(json_data, dict)
+                        and 'questions' in json_data):
+                    counts = split_counts(num_questions)
+                    prompts = [
+                        build_gemini_prompt(n, language, topic, base_ex_str,
+                                            cached, part=(i + 1, len(counts)))
+                        for i, n in enumerate(counts)
+                    ]
+                    logger.info("Splitting %d questions into %s",
+                                num_questions, counts)
                 else:
-                    # Fallback for other types
-                    base_ex_str = json.dumps(
-                        base_ex, indent=0, ensure_ascii=False)
-
-                gemini_prompt = f"""Create {num_questions} {language}-Mongolian translation exercises about "{topic}".
-
-REQUIREMENTS:
-1. Match the JSON structure exactly
-2. {num_questions} questions in the questions array
-3. Mix of {language}→Mongolian and Mongolian→{language} translations
-4. Use topic: {topic}
-5. Vary question_mode (TRANSLATE, CHOOSE, TYPE)
-6. Mongolian text uses "TEXT" or "TEXT_AUDIO" type
-7. Valid JSON only, no explanations
+                    counts = [num_questions]
+                    prompts = [build_gemini_prompt(
+                        num_questions, language, topic, base_ex_str, cached)]
 
-STRUCTURE:
-{base_ex_str}
-
-OUTPUT: Complete valid JSON object matching this structure."""
-
-                logger.debug(f"Prompt length: {len(gemini_prompt)}")
+                logger.debug("Prompt length: %d", len(prompts[0]))
 
             except Exception as e:
-                logger.error(f"Error creating prompt: {e}")
+                logger.error("Error creating prompt: %s", e)
                 return jsonify({"error": f"Failed to create prompt: {str(e)}"}), 500
 
             # Step 6: Call Gemini API
             logger.debug("Step 6: Calling Gemini API")
             try:
-                response = model.generate_content(
-                    gemini_prompt,
-                    generation_config={
-                        'temperature': 0.5,        # Lower temperature for more consistent JSON
-                        'max_output_tokens': 8192,  # Even larger for complex exercises
-                        'top_p': 0.9,             # Higher top_p for more complete responses
-                        'top_k': 20               # Lower top_k for more focused output
-                    }
-                )
-
-                if not response or not response.text:
+                if len(prompts) > 1:
+                    generated_texts = list(split_pool.map(
+                        lambda p: generate_text(generate_model, p), prompts))
+                else:
+                    generated_texts = [generate_text(generate_model, prompts[0])]
+
+                if not all(generated_texts):
                     logger.error("Empty response from Gemini")
                     return jsonify({"error": "Empty response from Gemini API"}), 500
 
-                generated_text = response.text.strip()
                 logger.info(
-                    f"✅ Gemini API call successful, response length: {len(generated_text)}")
-                logger.debug(f"First 100 chars: {generated_text[:100]}")
+                    "✅ Gemini API call successful, response length: %d",
+                    sum(map(len, generated_texts)))
+                if debug:
+                    logger.debug("First 100 chars: %s",
+                                 generated_texts[0][:100])
 
             except Exception as e:
-                logger.error(f"Gemini API call failed: {e}")
-                logger.error(f"Error type: {type(e)}")
+                logger.error("Gemini API call failed: %s", e)
+                logger.error("Error type: %s", type(e))
                 return jsonify({
                     "error": f"Gemini API failed: {str(e)}",
                     "error_type": str(type(e))
@@ -247,133 +775,47 @@ OUTPUT: Complete valid JSON object matching this structure."""
                 # Step 7: Parse JSON response
             logger.debug("Step 7: Parsing JSON response")
             try:
-                # Log the full response for debugging
-                logger.debug(f"Full response: {generated_text}")
-
-                # Check if response is truncated or incomplete
-                if len(generated_text.strip()) < 20:
-                    logger.error("Response too short, likely incomplete")
-                    return jsonify({"error": "Gemini response was too short/incomplete"}), 500
-
-                # Clean up response text
-                clean_text = generated_text.strip()
-
-                # Remove code block markers if present
-                if '```json' in clean_text:
-                    start = clean_text.find('```json') + 7
-                    end = clean_text.find('```', start)
-                    if end > start:
-                        clean_text = clean_text[start:end].strip()
-                        logger.debug("Removed ```json``` markers")
-                elif '```' in clean_text:
-                    start = clean_text.find('```') + 3
-                    end = clean_text.find('```', start)
-                    if end > start:
-                        clean_text = clean_text[start:end].strip()
-                        logger.debug("Removed ``` markers")
-
-                # Find JSON content
-                json_start = clean_text.find('{')
-                json_end = clean_text.rfind('}') + 1
-
-                if json_start >= 0 and json_end > json_start:
-                    clean_text = clean_text[json_start:json_end]
-                    logger.debug(f"Extracted JSON length: {len(clean_text)}")
-                else:
-                    logger.error("Could not find valid JSON boundaries")
-                    logger.error(
-                        f"json_start: {json_start}, json_end: {json_end}")
-                    return jsonify({
-                        "error": "Could not extract JSON from response",
-                        "raw_response": generated_text[:300]
-                    }), 500
-
-                # Validate JSON structure before parsing
-                if not clean_text.strip():
-                    logger.error("Empty JSON content after extraction")
-                    return jsonify({"error": "Empty JSON content"}), 500
-
-                    logger.debug(f"Final JSON to parse: {clean_text[:200]}...")
-
-                # Try to repair common JSON issues before parsing
-                def repair_json(text):
-                    """Attempt to repair common JSON formatting issues"""
-                    # Remove trailing commas
-                    import re
-                    text = re.sub(r',(\s*[}\]])', r'\1', text)
-
-                    # Ensure proper closing of arrays and objects
-                    open_braces = text.count('{')
-                    close_braces = text.count('}')
-                    open_brackets = text.count('[')
-                    close_brackets = text.count(']')
-
-                    # Add missing closing braces/brackets
-                    if open_braces > close_braces:
-                        text += '}' * (open_braces - close_braces)
-                    if open_brackets > close_brackets:
-                        text += ']' * (open_brackets - close_brackets)
-
-                    return text
-
-                # Try parsing original first, then repaired version
-                try:
-                    generated_questions = json.loads(clean_text)
-                    logger.debug("JSON parsed successfully on first attempt")
-                except json.JSONDecodeError as first_error:
-                    logger.warning(f"First JSON parse failed: {first_error}")
-                    logger.debug("Attempting to repair JSON...")
-
-                    try:
-                        repaired_text = repair_json(clean_text)
-                        generated_questions = json.loads(repaired_text)
-                        logger.info("JSON parsed successfully after repair")
-                    except json.JSONDecodeError as second_error:
-                        logger.error(
-                            f"JSON repair also failed: {second_error}")
-                        # Try to extract just the first complete object
-                        try:
-                            # Find the first complete JSON object
-                            brace_count = 0
-                            end_pos = 0
-                            for i, char in enumerate(clean_text):
-                                if char == '{':
-                                    brace_count += 1
-                                elif char == '}':
-                                    brace_count -= 1
-                                    if brace_count == 0:
-                                        end_pos = i + 1
-                                        break
-
-                            if end_pos > 0:
-                                partial_json = clean_text[:end_pos]
-                                generated_questions = json.loads(partial_json)
-                                logger.info(
-                                    "Successfully extracted partial JSON")
-                            else:
-                                raise json.JSONDecodeError(
-                                    "Could not extract valid JSON", clean_text, 0)
-                        except:
-                            raise second_error
+                parts = []
+                cacheable = True
+                for generated_text, n in zip(generated_texts, counts):
+                    part, part_cacheable = parse_generated_text(generated_text, n)
+                    parts.append(part)
+                    cacheable = cacheable and part_cacheable
+                generated_questions = merge_split_results(parts)
                 logger.info("✅ JSON parsing successful")
 
+                if use_cache and not cacheable:
+                    logger.warning(
+                        "⚠️  Result repaired or incomplete, not caching it")
+                elif use_cache:
+                    store_result(key, generated_questions)
+                    if topic_vec is not None:
+                        semantic_cache.set(
+                            topic_ns, topic_vec, generated_questions)
+
                 return jsonify({
                     "success": True,
                     "generated_questions": generated_questions,
                     "mode": "fast_local"
                 })
 
+            except ResponseError as e:
+                error = {"error": str(e)}
+                if e.raw_response is not None:
+                    error["raw_response"] = e.raw_response
+                return jsonify(error), 500
+
             except json.JSONDecodeError as e:
-                logger.error(f"JSON parsing failed: {e}")
-                logger.error(
-                    f"Raw response (first 500 chars): {generated_text[:500]}")
+                logger.error("JSON parsing failed: %s", e)
+                logger.error("Raw response (first 500 chars): %s",
+                             generated_text[:500])
                 return jsonify({
                     "error": f"Could not parse response as JSON: {str(e)}",
                     "raw_response": generated_text[:200] + "..." if len(generated_text) > 200 else generated_text
                 }), 500
 
         except Exception as e:
-            logger.error(f"Unexpected error in generate_fast: {e}")
+            logger.error("Unexpected error in generate_fast: %s", e)
             logger.exception("Full traceback:")
             return jsonify({
                 "error": f"Server error: {str(e)}",
@@ -413,7 +855,7 @@ def main():
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
     except Exception as e:
-        logger.error(f"Server error: {e}")
+        logger.error("Server error: %s", e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+AI Question Generator - Production Server
+Runs the local backend under gunicorn so slow Gemini calls don't block
+other clients (Linux/Mac only)
+"""
+
+import os
+from gunicorn.app.base import BaseApplication
+
+
+class GunicornApp(BaseApplication):
+    """Serve the Flask app with gunicorn's threaded workers"""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Called in every worker, so each gets its own app and Gemini client;
+        # importing here keeps the cache, log file and log thread out of
+        # the master process
+        from local_backend import create_app
+        return create_app()
+
+
+def main():
+    """Equivalent to: gunicorn -w 4 -k gthread --threads 8 'local_backend:create_app()'"""
+    options = {
+        'bind': os.getenv('BIND', '0.0.0.0:5000'),
+        'workers': int(os.getenv('WEB_WORKERS', '4')),
+        'worker_class': 'gthread',
+        'threads': int(os.getenv('WEB_THREADS', '8')),
+        # Gemini calls can take well over gunicorn's 30s default
+        'timeout': 120,
+    }
+
+    print("🚀 AI Question Generator - Production Mode")
+    print(f"🌐 Listening on {options['bind']} with {options['workers']} "
+          f"workers x {options['threads']} threads")
+    GunicornApp(options).run()
+
+
+if __name__ == "__main__":
+    main()